@@ -6,7 +6,7 @@ from tests.async_mock import patch, MagicMock, PropertyMock, AsyncMock
 from aiohttp import web
 import pytest
 
-from hass_nabucasa import Cloud
+from hass_nabucasa import MODE_DEV, Cloud
 
 from .utils.aiohttp import mock_aiohttp_client
 from .common import TestClient
@@ -14,6 +14,39 @@ from .common import TestClient
 logging.basicConfig(level=logging.DEBUG)
 
 
+@pytest.fixture(scope="session")
+def loop():
+    """Return an event loop shared by the whole test session."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    _cancel_tasks(loop)
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+def _cancel_tasks(loop):
+    """Cancel all pending tasks of loop and wait for them to finish.
+
+    Return the cancelled tasks.
+    """
+    tasks = asyncio.all_tasks(loop)
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+    return tasks
+
+
+@pytest.fixture(autouse=True)
+def no_pending_tasks(loop):
+    """Fail a test that leaves tasks running on the shared loop."""
+    yield
+    tasks = _cancel_tasks(loop)
+    if tasks:
+        pytest.fail(f"Test left pending tasks: {tasks}")
+
+
 @pytest.fixture
 async def aioclient_mock(loop):
     """Fixture to mock aioclient calls."""
@@ -63,6 +96,32 @@ def cloud_client(cloud_mock):
     yield cloud_mock.client
 
 
+@pytest.fixture
+def wired_cloud(cloud_client):
+    """Return a dev mode cloud with mocked connection subsystems."""
+    cloud = Cloud(cloud_client, MODE_DEV)
+
+    assert len(cloud._on_start) == 2
+    cloud._on_start.clear()
+    assert len(cloud._on_stop) == 3
+    cloud._on_stop.clear()
+
+    cloud.iot = MagicMock(connect=AsyncMock(), disconnect=AsyncMock())
+    cloud.remote = MagicMock(connect=AsyncMock(), disconnect=AsyncMock())
+    cloud.google_report_state = MagicMock(connect=AsyncMock(), disconnect=AsyncMock())
+
+    cloud._on_start.extend([cloud.iot.connect, cloud.remote.connect])
+    cloud._on_stop.extend(
+        [
+            cloud.iot.disconnect,
+            cloud.remote.disconnect,
+            cloud.google_report_state.disconnect,
+        ]
+    )
+
+    yield cloud
+
+
 @pytest.fixture
 def mock_cognito():
     """Mock warrant."""
@@ -1,17 +1,21 @@
 """Test the cloud component."""
-import json
-from tests.async_mock import AsyncMock, patch, MagicMock, Mock, PropertyMock
+from types import MappingProxyType
+from tests.async_mock import patch, MagicMock, Mock
 
-import hass_nabucasa as cloud
+import orjson
+import pytest
+
+from hass_nabucasa import MODE_DEV, SERVERS, Cloud
 from hass_nabucasa.utils import utcnow
 
+_TZ_REF = utcnow().replace(
+    year=2017, month=1, day=1, hour=0, minute=0, second=0, microsecond=0
+)
 
-def test_constructor_loads_info_from_constant(cloud_client):
-    """Test non-dev mode loads info from SERVERS constant."""
-    with patch.dict(
-        cloud.SERVERS,
-        {
-            "beer": {
+_BEER_SERVER = MappingProxyType(
+    {
+        "beer": MappingProxyType(
+            {
                 "cognito_client_id": "test-cognito_client_id",
                 "user_pool_id": "test-user_pool_id",
                 "region": "test-region",
@@ -26,62 +30,49 @@ def test_constructor_loads_info_from_constant(cloud_client):
                 "voice_api_url": "test-voice-api-url",
                 "thingtalk_url": "test-thingtalk-url",
             }
-        },
-    ):
-        cl = cloud.Cloud(cloud_client, "beer")
+        )
+    }
+)
 
-    assert cl.mode == "beer"
-    assert cl.cognito_client_id == "test-cognito_client_id"
-    assert cl.user_pool_id == "test-user_pool_id"
-    assert cl.region == "test-region"
-    assert cl.relayer == "test-relayer"
-    assert cl.subscription_info_url == "test-subscription-info-url"
-    assert cl.cloudhook_create_url == "test-cloudhook_create_url"
-    assert cl.remote_api_url == "test-remote_api_url"
-    assert cl.alexa_access_token_url == "test-alexa-token-url"
-    assert cl.acme_directory_server == "test-acme-directory-server"
-    assert cl.google_actions_report_state_url == "test-google-actions-report-state-url"
-    assert cl.account_link_url == "test-account-link-url"
-    assert cl.thingtalk_url == "test-thingtalk-url"
-
-
-async def test_initialize_loads_info(cloud_client):
-    """Test initialize will load info from config file."""
-    cl = cloud.Cloud(cloud_client, cloud.MODE_DEV)
-
-    assert len(cl._on_start) == 2
-    cl._on_start.clear()
-    assert len(cl._on_stop) == 3
-    cl._on_stop.clear()
-
-    info_file = MagicMock(
-        read_text=Mock(
-            return_value=json.dumps(
-                {
-                    "id_token": "test-id-token",
-                    "access_token": "test-access-token",
-                    "refresh_token": "test-refresh-token",
-                }
-            )
-        ),
-        exists=Mock(return_value=True),
+
+def _info_file(read_return=None, *, exists=True, relative_to=None):
+    """Return a mocked auth info file."""
+    return MagicMock(
+        read_text=Mock(return_value=read_return),
+        exists=Mock(return_value=exists),
+        relative_to=Mock(return_value=relative_to),
     )
 
-    cl.iot = MagicMock()
-    cl.iot.connect = AsyncMock()
 
-    cl.remote = MagicMock()
-    cl.remote.connect = AsyncMock()
+def test_constructor_loads_info_from_constant(cloud_client):
+    """Test non-dev mode loads info from SERVERS constant."""
+    with patch.dict(SERVERS, _BEER_SERVER):
+        cl = Cloud(cloud_client, "beer")
 
-    cl._on_start.extend([cl.iot.connect, cl.remote.connect])
+    assert cl.mode == "beer"
+    assert {key: getattr(cl, key) for key in _BEER_SERVER["beer"]} == dict(
+        _BEER_SERVER["beer"]
+    )
+
+
+async def test_initialize_loads_info(wired_cloud):
+    """Test initialize will load info from config file."""
+    cl = wired_cloud
+
+    info_file = _info_file(
+        orjson.dumps(
+            {
+                "id_token": "test-id-token",
+                "access_token": "test-access-token",
+                "refresh_token": "test-refresh-token",
+            }
+        ).decode()
+    )
 
     with patch(
         "hass_nabucasa.Cloud._decode_claims",
         return_value={"custom:sub-exp": "2080-01-01"},
-    ), patch(
-        "hass_nabucasa.Cloud.user_info_path",
-        new_callable=PropertyMock(return_value=info_file),
-    ), patch(
+    ), patch.object(type(cl), "user_info_path", info_file), patch(
         "hass_nabucasa.auth.CognitoAuth.async_check_token"
     ):
         await cl.initialize()
@@ -93,73 +84,37 @@ async def test_initialize_loads_info(cloud_client):
     assert len(cl.remote.connect.mock_calls) == 1
 
 
-async def test_initialize_loads_invalid_info(cloud_client, caplog):
+async def test_initialize_loads_invalid_info(wired_cloud, caplog):
     """Test initialize load invalid info from config file."""
-    cl = cloud.Cloud(cloud_client, cloud.MODE_DEV)
-
-    info_file = MagicMock(
-        read_text=Mock(return_value="invalid json"),
-        exists=Mock(return_value=True),
-        relative_to=Mock(return_value=".cloud/production_auth.json"),
-    )
-
-    cl.iot = MagicMock()
-    cl.iot.connect = AsyncMock()
-
-    cl.remote = MagicMock()
-    cl.remote.connect = AsyncMock()
+    cl = wired_cloud
+    info_file = _info_file("invalid json", relative_to=".cloud/production_auth.json")
 
-    cl._on_start.extend([cl.iot.connect, cl.remote.connect])
-
-    with patch("hass_nabucasa.Cloud._decode_claims"), patch(
-        "hass_nabucasa.Cloud.user_info_path",
-        new_callable=PropertyMock(return_value=info_file),
+    with patch("hass_nabucasa.Cloud._decode_claims"), patch.object(
+        type(cl), "user_info_path", info_file
     ):
         await cl.initialize()
 
     assert cl.id_token is None
     assert len(cl.iot.connect.mock_calls) == 0
     assert len(cl.remote.connect.mock_calls) == 0
-    assert (
-        "Error loading cloud authentication info from .cloud/production_auth.json: Expecting value: line 1 column 1 (char 0)"
-        in caplog.text
+    assert any(
+        record.levelname == "WARNING"
+        and record.getMessage()
+        == "Error loading cloud authentication info from .cloud/production_auth.json: Expecting value: line 1 column 1 (char 0)"
+        for record in caplog.records
     )
 
 
-async def test_logout_clears_info(cloud_client):
+async def test_logout_clears_info(wired_cloud):
     """Test logging out disconnects and removes info."""
-    cl = cloud.Cloud(cloud_client, cloud.MODE_DEV)
-
-    assert len(cl._on_start) == 2
-    cl._on_start.clear()
-    assert len(cl._on_stop) == 3
-    cl._on_stop.clear()
-
-    info_file = MagicMock(
-        exists=Mock(return_value=True), unlink=Mock(return_value=True)
-    )
+    cl = wired_cloud
+    info_file = _info_file()
 
     cl.id_token = "id_token"
     cl.access_token = "access_token"
     cl.refresh_token = "refresh_token"
 
-    cl.iot = MagicMock()
-    cl.iot.disconnect = AsyncMock()
-
-    cl.google_report_state = MagicMock()
-    cl.google_report_state.disconnect = AsyncMock()
-
-    cl.remote = MagicMock()
-    cl.remote.disconnect = AsyncMock()
-
-    cl._on_stop.extend(
-        [cl.iot.disconnect, cl.remote.disconnect, cl.google_report_state.disconnect]
-    )
-
-    with patch(
-        "hass_nabucasa.Cloud.user_info_path",
-        new_callable=PropertyMock(return_value=info_file),
-    ):
+    with patch.object(type(cl), "user_info_path", info_file):
         await cl.logout()
 
     assert len(cl.iot.disconnect.mock_calls) == 1
@@ -173,7 +128,7 @@ async def test_logout_clears_info(cloud_client):
 
 def test_write_user_info(cloud_client):
     """Test writing user info works."""
-    cl = cloud.Cloud(cloud_client, cloud.MODE_DEV)
+    cl = Cloud(cloud_client, MODE_DEV)
 
     cl.id_token = "test-id-token"
     cl.access_token = "test-access-token"
@@ -185,7 +140,7 @@ def test_write_user_info(cloud_client):
     mock_file = mock_write.return_value.__enter__.return_value
 
     assert mock_file.write.called
-    data = json.loads(mock_file.write.mock_calls[0][1][0])
+    data = orjson.loads(mock_file.write.mock_calls[0][1][0])
     assert data == {
         "access_token": "test-access-token",
         "id_token": "test-id-token",
@@ -193,41 +148,21 @@ def test_write_user_info(cloud_client):
     }
 
 
-def test_subscription_expired(cloud_client):
-    """Test subscription being expired after 3 days of expiration."""
-    cl = cloud.Cloud(cloud_client, cloud.MODE_DEV)
-
-    token_val = {"custom:sub-exp": "2017-11-13"}
-    with patch.object(cl, "_decode_claims", return_value=token_val), patch(
-        "hass_nabucasa.utcnow",
-        return_value=utcnow().replace(year=2017, month=11, day=13),
-    ):
-        assert not cl.subscription_expired
-
-    with patch.object(cl, "_decode_claims", return_value=token_val), patch(
-        "hass_nabucasa.utcnow",
-        return_value=utcnow().replace(
-            year=2017, month=11, day=19, hour=23, minute=59, second=59
-        ),
-    ):
-        assert not cl.subscription_expired
-
-    with patch.object(cl, "_decode_claims", return_value=token_val), patch(
-        "hass_nabucasa.utcnow",
-        return_value=utcnow().replace(
-            year=2017, month=11, day=20, hour=0, minute=0, second=0
-        ),
-    ):
-        assert cl.subscription_expired
-
-
-def test_subscription_not_expired(cloud_client):
-    """Test subscription not being expired."""
-    cl = cloud.Cloud(cloud_client, cloud.MODE_DEV)
-
-    token_val = {"custom:sub-exp": "2017-11-13"}
-    with patch.object(cl, "_decode_claims", return_value=token_val), patch(
-        "hass_nabucasa.utcnow",
-        return_value=utcnow().replace(year=2017, month=11, day=9),
-    ):
-        assert not cl.subscription_expired
+@pytest.mark.parametrize(
+    "now,expected",
+    [
+        ((2017, 11, 13, 0, 0, 0), False),
+        ((2017, 11, 19, 23, 59, 59), False),
+        ((2017, 11, 20, 0, 0, 0), False),
+        ((2017, 11, 20, 0, 0, 1), True),
+        ((2017, 11, 9, 0, 0, 0), False),
+    ],
+)
+def test_subscription_expiry(cloud_client, now, expected):
+    """Test subscription only expires after 7 days past expiration."""
+    cl = Cloud(cloud_client, MODE_DEV)
+
+    with patch.object(
+        cl, "_decode_claims", return_value={"custom:sub-exp": "2017-11-13"}
+    ), patch("hass_nabucasa.utcnow", return_value=_TZ_REF.replace(*now)):
+        assert cl.subscription_expired is expected
@@ -1,41 +1,88 @@
 """Test the cloud.iot module."""
 import asyncio
-from tests.async_mock import AsyncMock, patch, MagicMock, Mock
+from types import SimpleNamespace
+from tests.async_mock import AsyncMock, patch, MagicMock, Mock, PropertyMock
 
 from aiohttp import WSMsgType
 import pytest
 
-from hass_nabucasa import iot, iot_base
+from hass_nabucasa.iot import (
+    HANDLERS,
+    CloudIoT,
+    async_handle_alexa,
+    async_handle_cloud,
+    async_handle_google_actions,
+    async_handle_remote_sni,
+    async_handle_webhook,
+)
+from hass_nabucasa.iot_base import STATE_CONNECTED
 
 
-@pytest.fixture
+def _ws_text(msg):
+    """Return a websocket text message carrying msg."""
+    return SimpleNamespace(type=WSMsgType.text, json=lambda m=msg: m)
+
+
+def _broken_handler(*args, **kwargs):
+    """Handle a message by raising."""
+    raise Exception("Broken")
+
+
+@pytest.fixture(scope="function")
 def cloud_mock_iot(auth_cloud_mock):
     """Mock cloud class."""
     auth_cloud_mock.subscription_expired = False
     yield auth_cloud_mock
 
 
-async def test_cloud_calling_handler(mock_iot_client, cloud_mock_iot):
-    """Test we call handle message with correct info."""
-    conn = iot.CloudIoT(cloud_mock_iot)
+@pytest.fixture
+def ws_msg(request):
+    """Return the text message received by the mocked IoT client."""
+    return _ws_text(request.param)
+
+
+@pytest.fixture
+def iot_tasks(cloud_mock_iot):
+    """Collect the tasks scheduled by the cloud while handling messages."""
+    tasks = []
+    run_task = cloud_mock_iot.run_task
+
+    def _run_task(coro):
+        """Schedule and remember a task."""
+        task = run_task(coro)
+        tasks.append(task)
+        return task
+
+    cloud_mock_iot.run_task = _run_task
+    return tasks
+
+
+@pytest.fixture
+def connected_cloud_iot(mock_iot_client, cloud_mock_iot, iot_tasks, ws_msg):
+    """Return a CloudIoT whose client receives ws_msg and then closes."""
+    # Keep the client open, the CLOSED frame ends the receive loop
+    type(mock_iot_client).closed = PropertyMock(return_value=False)
     mock_iot_client.receive = AsyncMock(
-        return_value=MagicMock(
-            type=WSMsgType.text,
-            json=MagicMock(
-                return_value={
-                    "msgid": "test-msg-id",
-                    "handler": "test-handler",
-                    "payload": "test-payload",
-                }
-            ),
-        )
+        side_effect=[ws_msg, SimpleNamespace(type=WSMsgType.CLOSED)]
     )
-    mock_handler = AsyncMock(return_value="response")
     mock_iot_client.send_json = AsyncMock()
+    yield CloudIoT(cloud_mock_iot)
+
+
+@pytest.mark.parametrize(
+    "ws_msg",
+    [{"msgid": "test-msg-id", "handler": "test-handler", "payload": "test-payload"}],
+    indirect=True,
+)
+async def test_cloud_calling_handler(
+    mock_iot_client, cloud_mock_iot, iot_tasks, connected_cloud_iot
+):
+    """Test we call handle message with correct info."""
+    mock_handler = AsyncMock(return_value="response")
 
-    with patch.dict(iot.HANDLERS, {"test-handler": mock_handler}, clear=True):
-        await conn.connect()
-        await asyncio.sleep(0)
+    with patch.dict(HANDLERS, {"test-handler": mock_handler}, clear=True):
+        await connected_cloud_iot.connect()
+        await asyncio.wait_for(asyncio.gather(*iot_tasks), timeout=1)
 
     # Check that we sent message to handler correctly
     assert len(mock_handler.mock_calls) == 1
@@ -52,25 +99,23 @@ async def test_cloud_calling_handler(mock_iot_client, cloud_mock_iot):
     }
 
 
-async def test_connection_msg_for_unknown_handler(mock_iot_client, cloud_mock_iot):
+@pytest.mark.parametrize(
+    "ws_msg",
+    [
+        {
+            "msgid": "test-msg-id",
+            "handler": "non-existing-handler",
+            "payload": "test-payload",
+        }
+    ],
+    indirect=True,
+)
+async def test_connection_msg_for_unknown_handler(
+    mock_iot_client, iot_tasks, connected_cloud_iot
+):
     """Test a msg for an unknown handler."""
-    conn = iot.CloudIoT(cloud_mock_iot)
-    mock_iot_client.receive = AsyncMock(
-        return_value=MagicMock(
-            type=WSMsgType.text,
-            json=MagicMock(
-                return_value={
-                    "msgid": "test-msg-id",
-                    "handler": "non-existing-handler",
-                    "payload": "test-payload",
-                }
-            ),
-        )
-    )
-    mock_iot_client.send_json = AsyncMock()
-
-    await conn.connect()
-    await asyncio.sleep(0)
+    await connected_cloud_iot.connect()
+    await asyncio.wait_for(asyncio.gather(*iot_tasks), timeout=1)
 
     # Check that we sent the correct error
     assert len(mock_iot_client.send_json.mock_calls) == 1
@@ -80,28 +125,18 @@ async def test_connection_msg_for_unknown_handler(mock_iot_client, cloud_mock_io
     }
 
 
-async def test_connection_msg_for_handler_raising(mock_iot_client, cloud_mock_iot):
+@pytest.mark.parametrize(
+    "ws_msg",
+    [{"msgid": "test-msg-id", "handler": "test-handler", "payload": "test-payload"}],
+    indirect=True,
+)
+async def test_connection_msg_for_handler_raising(
+    mock_iot_client, iot_tasks, connected_cloud_iot
+):
     """Test we sent error when handler raises exception."""
-    conn = iot.CloudIoT(cloud_mock_iot)
-    mock_iot_client.receive = AsyncMock(
-        return_value=MagicMock(
-            type=WSMsgType.text,
-            json=MagicMock(
-                return_value={
-                    "msgid": "test-msg-id",
-                    "handler": "test-handler",
-                    "payload": "test-payload",
-                }
-            ),
-        )
-    )
-    mock_iot_client.send_json = AsyncMock()
-
-    with patch.dict(
-        iot.HANDLERS, {"test-handler": Mock(side_effect=Exception("Broken"))}
-    ):
-        await conn.connect()
-        await asyncio.sleep(0)
+    with patch.dict(HANDLERS, {"test-handler": _broken_handler}):
+        await connected_cloud_iot.connect()
+        await asyncio.wait_for(asyncio.gather(*iot_tasks), timeout=1)
 
     # Check that we sent the correct error
     assert len(mock_iot_client.send_json.mock_calls) == 1
@@ -114,36 +149,26 @@ async def test_connection_msg_for_handler_raising(mock_iot_client, cloud_mock_io
 async def test_handling_core_messages_logout(cloud_mock_iot):
     """Test handling core messages."""
     cloud_mock_iot.logout = AsyncMock()
-    await iot.async_handle_cloud(
+    await async_handle_cloud(
         cloud_mock_iot, {"action": "logout", "reason": "Logged in at two places."}
     )
     assert len(cloud_mock_iot.logout.mock_calls) == 1
 
 
-async def test_handler_alexa(cloud_mock):
-    """Test handler Alexa."""
-    cloud_mock.client.mock_return.append({"test": 5})
-    resp = await iot.async_handle_alexa(cloud_mock, {"test-discovery": True})
-
-    assert len(cloud_mock.client.mock_alexa) == 1
-    assert resp == {"test": 5}
-
-
-async def test_handler_google(cloud_mock):
-    """Test handler Google."""
+@pytest.mark.parametrize(
+    "handler,attr",
+    [
+        (async_handle_alexa, "mock_alexa"),
+        (async_handle_google_actions, "mock_google"),
+        (async_handle_webhook, "mock_webhooks"),
+    ],
+)
+async def test_handler_forwarding(cloud_mock, handler, attr):
+    """Test handlers forwarding messages to the client."""
     cloud_mock.client.mock_return.append({"test": 5})
-    resp = await iot.async_handle_google_actions(cloud_mock, {"test-discovery": True})
+    resp = await handler(cloud_mock, {"test-discovery": True})
 
-    assert len(cloud_mock.client.mock_google) == 1
-    assert resp == {"test": 5}
-
-
-async def test_handler_webhook(cloud_mock):
-    """Test handler Webhook."""
-    cloud_mock.client.mock_return.append({"test": 5})
-    resp = await iot.async_handle_webhook(cloud_mock, {"test-discovery": True})
-
-    assert len(cloud_mock.client.mock_webhooks) == 1
+    assert len(getattr(cloud_mock.client, attr)) == 1
     assert resp == {"test": 5}
 
 
@@ -151,7 +176,7 @@ async def test_handler_remote_sni(cloud_mock):
     """Test handler Webhook."""
     assert not cloud_mock.client.pref_should_connect
     cloud_mock.remote.snitun_server = "1.1.1.1"
-    resp = await iot.async_handle_remote_sni(cloud_mock, {"ip_address": "8.8.8.8"})
+    resp = await async_handle_remote_sni(cloud_mock, {"ip_address": "8.8.8.8"})
 
     assert cloud_mock.client.pref_should_connect
     assert resp == {"server": "1.1.1.1"}
@@ -159,9 +184,9 @@ async def test_handler_remote_sni(cloud_mock):
 
 async def test_send_message_no_answer(cloud_mock_iot):
     """Test sending a message that expects no answer."""
-    cloud_iot = iot.CloudIoT(cloud_mock_iot)
-    cloud_iot.state = iot_base.STATE_CONNECTED
-    cloud_iot.client = MagicMock(send_json=AsyncMock())
+    cloud_iot = CloudIoT(cloud_mock_iot)
+    cloud_iot.state = STATE_CONNECTED
+    cloud_iot.client = Mock(spec=["send_json"], send_json=AsyncMock())
 
     await cloud_iot.async_send_message("webhook", {"msg": "yo"}, expect_answer=False)
     assert not cloud_iot._response_handler
@@ -173,9 +198,12 @@ async def test_send_message_no_answer(cloud_mock_iot):
 
 async def test_send_message_answer(loop, cloud_mock_iot):
     """Test sending a message that expects an answer."""
-    cloud_iot = iot.CloudIoT(cloud_mock_iot)
-    cloud_iot.state = iot_base.STATE_CONNECTED
-    cloud_iot.client = MagicMock(send_json=AsyncMock())
+    cloud_iot = CloudIoT(cloud_mock_iot)
+    cloud_iot.state = STATE_CONNECTED
+    sent = asyncio.Event()
+    cloud_iot.client = Mock(
+        spec=["send_json"], send_json=AsyncMock(side_effect=lambda msg: sent.set())
+    )
 
     uuid = 5
 
@@ -183,7 +211,7 @@ async def test_send_message_answer(loop, cloud_mock_iot):
         send_task = loop.create_task(
             cloud_iot.async_send_message("webhook", {"msg": "yo"})
         )
-        await asyncio.sleep(0)
+        await asyncio.wait_for(sent.wait(), timeout=1)
 
     assert len(cloud_iot.client.send_json.mock_calls) == 1
     assert len(cloud_iot._response_handler) == 1
@@ -196,28 +224,14 @@ async def test_send_message_answer(loop, cloud_mock_iot):
     assert response == {"response": True}
 
 
-async def test_handling_core_messages_user_notifcation(cloud_mock_iot):
+@pytest.mark.parametrize("action", ["user_notification", "critical_user_notification"])
+async def test_handling_core_messages_user_notifcation(cloud_mock_iot, action):
     """Test handling core messages."""
     cloud_mock_iot.client.user_message = MagicMock()
 
-    await iot.async_handle_cloud(
+    await async_handle_cloud(
         cloud_mock_iot,
-        {"action": "user_notification", "title": "Test", "message": "My message"},
-    )
-    assert len(cloud_mock_iot.client.user_message.mock_calls) == 1
-
-
-async def test_handling_core_messages_critical_user_notifcation(cloud_mock_iot):
-    """Test handling core messages."""
-    cloud_mock_iot.client.user_message = MagicMock()
-
-    await iot.async_handle_cloud(
-        cloud_mock_iot,
-        {
-            "action": "critical_user_notification",
-            "title": "Test",
-            "message": "My message",
-        },
+        {"action": action, "title": "Test", "message": "My message"},
     )
     assert len(cloud_mock_iot.client.user_message.mock_calls) == 1
 
@@ -226,7 +240,7 @@ async def test_handling_core_messages_remote_disconnect(cloud_mock_iot):
     """Test handling core messages."""
     cloud_mock_iot.remote.disconnect = AsyncMock()
 
-    await iot.async_handle_cloud(
+    await async_handle_cloud(
         cloud_mock_iot,
         {"action": "disconnect_remote"},
     )
@@ -237,8 +251,11 @@ async def test_handling_core_messages_evaluate_remote_security(cloud_mock_iot):
     """Test handling core messages."""
     cloud_mock_iot.client = MagicMock()
 
-    await iot.async_handle_cloud(
+    await async_handle_cloud(
         cloud_mock_iot,
         {"action": "evaluate_remote_security"},
     )
     assert len(cloud_mock_iot.client.loop.mock_calls) == 1
+
+    # Close the reconnect coroutine that the mocked loop never schedules
+    cloud_mock_iot.client.loop.create_task.mock_calls[0][1][0].close()
@@ -50,6 +50,14 @@ async def snitun_mock():
         yield snitun
 
 
+async def _shutdown_remote(remote):
+    """Stop the background tasks of a remote instance."""
+    tasks = [task for task in (remote._acme_task, remote._reconnect_task) if task]
+    await remote.stop()
+    await remote.close_backend()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
 def test_init_remote(auth_cloud_mock):
     """Init remote object."""
     RemoteUI(auth_cloud_mock)
@@ -115,6 +123,8 @@ async def test_load_backend_exists_cert(
     assert auth_cloud_mock.client.mock_dispatcher[0][0] == DISPATCH_REMOTE_BACKEND_UP
     assert auth_cloud_mock.client.mock_dispatcher[1][0] == DISPATCH_REMOTE_CONNECT
 
+    await _shutdown_remote(remote)
+
 
 async def test_load_backend_not_exists_cert(
     auth_cloud_mock, acme_mock, mock_cognito, aioclient_mock, snitun_mock
@@ -168,6 +178,8 @@ async def test_load_backend_not_exists_cert(
     assert remote._acme_task
     assert remote._reconnect_task
 
+    await _shutdown_remote(remote)
+
 
 async def test_load_and_unload_backend(
     auth_cloud_mock, valid_acme_mock, mock_cognito, aioclient_mock, snitun_mock
@@ -277,6 +289,8 @@ async def test_load_backend_exists_wrong_cert(
     assert snitun_mock.connect_args[0] == b"test-token"
     assert snitun_mock.connect_args[3] == 400
 
+    await _shutdown_remote(remote)
+
 
 async def test_call_disconnect(
     auth_cloud_mock, acme_mock, mock_cognito, aioclient_mock, snitun_mock
@@ -360,6 +374,8 @@ async def test_load_backend_no_autostart(
     assert snitun_mock.connect_args[3] == 400
     assert auth_cloud_mock.client.mock_dispatcher[-1][0] == DISPATCH_REMOTE_CONNECT
 
+    await _shutdown_remote(remote)
+
 
 async def test_get_certificate_details(
     auth_cloud_mock, acme_mock, mock_cognito, aioclient_mock, snitun_mock
@@ -440,6 +456,8 @@ async def test_certificate_task_no_backend(
         assert acme_mock.call_issue
         assert snitun_mock.call_start
 
+    await _shutdown_remote(remote)
+
 
 async def test_certificate_task_renew_cert(
     loop, auth_cloud_mock, acme_mock, mock_cognito, aioclient_mock, snitun_mock
@@ -478,6 +496,8 @@ async def test_certificate_task_renew_cert(
         await asyncio.sleep(0.1)
         assert acme_mock.call_issue
 
+    await _shutdown_remote(remote)
+
 
 async def test_refresh_token_no_sub(auth_cloud_mock):
     """Test that we rais SubscriptionExpired if expired sub."""